@@ -0,0 +1,105 @@
+"""Row filters for the variant table.
+
+If Numba is installed, the filter is compiled to machine code and runs in parallel over the columns.
+Otherwise a pure-Python scan, generated for the criteria actually in use, is run instead."""
+
+from functools import lru_cache  # Import lru_cache for keeping the generated scans
+
+try:  # Numba is optional, the program works the same without it
+    import numpy as np
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+if njit is not None:
+
+    _CHUNK = 1 << 16  # Rows handled by one task of the parallel loops
+    # Positions are int32, so any bound outside this range matches the same rows as these ends of it
+    _POSITION_MIN, _POSITION_MAX = -2 ** 31 - 1, 2 ** 31
+
+    @njit(inline='always')
+    def _matches(i, patient_codes, chr_codes, pos_start, pos_end, gene_codes,
+                 patient_q, chr_q, lo, hi, gene_q, use_patient, use_chr, use_lo, use_hi, use_gene):
+        return (not use_patient or patient_codes[i] == patient_q) and \
+               (not use_chr or chr_codes[i] == chr_q) and \
+               (not use_gene or gene_codes[i] == gene_q) and \
+               (not use_lo or pos_start[i] >= lo) and \
+               (not use_hi or pos_end[i] <= hi)
+
+    @njit(parallel=True, cache=True)
+    def _filter_kernel(patient_codes, chr_codes, pos_start, pos_end, gene_codes,
+                       patient_q, chr_q, lo, hi, gene_q,
+                       use_patient, use_chr, use_lo, use_hi, use_gene):
+        n = len(pos_start)
+        n_chunks = (n + _CHUNK - 1) // _CHUNK
+        counts = np.zeros(n_chunks, np.int64)
+        for chunk in prange(n_chunks):  # First pass: count the matches of each chunk, chunks run in parallel
+            count = 0
+            for i in range(chunk * _CHUNK, min(n, (chunk + 1) * _CHUNK)):
+                if _matches(i, patient_codes, chr_codes, pos_start, pos_end, gene_codes,
+                            patient_q, chr_q, lo, hi, gene_q, use_patient, use_chr, use_lo, use_hi, use_gene):
+                    count += 1
+            counts[chunk] = count
+        offsets = np.cumsum(counts) - counts  # Where each chunk starts writing in the output
+        rows = np.empty(counts.sum(), np.int64)  # Exactly as large as the result, no per-row temporary
+        for chunk in prange(n_chunks):  # Second pass: each chunk writes its matching rows in its own slice
+            k = offsets[chunk]
+            for i in range(chunk * _CHUNK, min(n, (chunk + 1) * _CHUNK)):
+                if _matches(i, patient_codes, chr_codes, pos_start, pos_end, gene_codes,
+                            patient_q, chr_q, lo, hi, gene_q, use_patient, use_chr, use_lo, use_hi, use_gene):
+                    rows[k] = i
+                    k += 1
+        return rows
+
+    def filter_variants(patient_codes, chr_codes, pos_start, pos_end, gene_codes,
+                        patient_q=None, chr_q=None, lo=None, hi=None, gene_q=None):
+        """Returns the rows matching every given code or position (None means the criterion is not used)"""
+        columns = [np.asarray(column) for column in (patient_codes, chr_codes, pos_start, pos_end, gene_codes)]
+        # Bounds too large for the kernel's int64 arguments are brought into range without changing the result
+        lo = min(max(lo, _POSITION_MIN), _POSITION_MAX) if lo is not None else None
+        hi = min(max(hi, _POSITION_MIN), _POSITION_MAX) if hi is not None else None
+        rows = _filter_kernel(*columns,  # NumPy views share the memory of the arrays, nothing is copied
+                              patient_q or 0, chr_q or 0, lo or 0, hi or 0, gene_q or 0,
+                              patient_q is not None, chr_q is not None, lo is not None,
+                              hi is not None, gene_q is not None)
+        return rows.tolist()
+
+else:
+
+    def filter_variants(patient_codes, chr_codes, pos_start, pos_end, gene_codes,
+                        patient_q=None, chr_q=None, lo=None, hi=None, gene_q=None):
+        """Returns the rows matching every given code or position (None means the criterion is not used)"""
+        return filter_rows(range(len(pos_start)), patient_codes, chr_codes, pos_start, pos_end, gene_codes,
+                           patient_q, chr_q, lo, hi, gene_q)
+
+# Comparison made for each criterion, in the order they are checked
+_CLAUSES = (('patient_q', 'patient_codes[row] == patient_q'),
+            ('chr_q', 'chr_codes[row] == chr_q'),
+            ('gene_q', 'gene_codes[row] == gene_q'),
+            ('lo', 'pos_start[row] >= lo'),
+            ('hi', 'pos_end[row] <= hi'))
+
+@lru_cache(maxsize=None)  # There are only 32 combinations of criteria
+def _compile_scan(active):
+    """Generates and compiles a scan containing only the comparisons of the active criteria.
+       The values searched for are arguments of the scan, they are never part of the generated code"""
+    condition = " and ".join(clause for name, clause in _CLAUSES if name in active) or "True"
+    source = ("def scan(rows, patient_codes, chr_codes, pos_start, pos_end, gene_codes,\n"
+              "         patient_q, chr_q, lo, hi, gene_q):\n"
+              f"    return [row for row in rows if {condition}]\n")
+    namespace = {}
+    exec(compile(source, f"<scan: {condition}>", "exec"), namespace)
+    return namespace["scan"]
+
+def filter_rows(rows, patient_codes, chr_codes, pos_start, pos_end, gene_codes,
+                patient_q=None, chr_q=None, lo=None, hi=None, gene_q=None):
+    """Keeps the given rows that match every given code or position (None means the criterion is not used).
+       Used instead of filter_variants when an index has already narrowed the search to a few rows"""
+    values = dict(patient_q=patient_q, chr_q=chr_q, lo=lo, hi=hi, gene_q=gene_q)
+    scan = _compile_scan(frozenset(name for name, value in values.items() if value is not None))
+    return scan(rows, patient_codes, chr_codes, pos_start, pos_end, gene_codes, **values)
+
+def warm_up(patient_codes, chr_codes, pos_start, pos_end, gene_codes):
+    """Runs the filter once on the first row of the given columns, so that it is compiled for their types
+       (and read-only or not) and compilation does not delay the first search"""
+    filter_variants(patient_codes[:1], chr_codes[:1], pos_start[:1], pos_end[:1], gene_codes[:1], 0, 0, 0, 0, 0)
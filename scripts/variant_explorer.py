@@ -1,123 +1,620 @@
 import csv  # Import CSV library for reading CSV files
+import io  # Import io for pickling the cached objects in memory before writing them
+import mmap  # Import mmap for using the cached arrays straight from the file
+import os  # Import os for counting CPUs and replacing the cache file in one step
+import pickle  # Import pickle for saving the loaded data between runs
+import sys  # Import sys for interning strings and writing to the console in large blocks
+from array import array  # Import array for compact typed columns of integers
+from bisect import bisect_left, bisect_right  # Import bisect for binary searches on sorted positions
+from collections import Counter  # Import Counter for counting occurrences in a single C-level pass
+from concurrent.futures import ProcessPoolExecutor  # Import ProcessPoolExecutor for parsing files in parallel
+from itertools import compress, repeat  # Import compress for selecting rows, repeat for filling a column
+from operator import itemgetter, sub  # Import itemgetter for picking the needed fields of each row
 from pathlib import Path  # Import Path for handling file and directory paths
 
+import filters  # Import the row filters (compiled with Numba when it is installed)
+
+try:  # pyarrow is optional, it only makes reading the variant files faster
+    import pyarrow as pa
+    from pyarrow import csv as arrow_csv
+except ImportError:
+    arrow_csv = None
+
+try:  # Line editing and history for the prompts (not available on Windows)
+    import readline  # Importing it is enough, input() then uses it
+except ImportError:
+    pass
+
+VARIANT_COLUMNS = ("chr", "pos_start", "pos_end", "reference", "genotype", "gene_symbol")
+CACHE_VERSION = 14  # Increase whenever the cached classes change, so that older caches are ignored
+
 class Phenotype:
     """Structures phenotype information including its code, label, and URI. 
        Also stores genes associated with this phenotype"""
     
+    __slots__ = ('code', 'label', 'uri', 'genes', '_gene_count')  # Fixed attributes, no per-instance __dict__
+
     def __init__(self, code, label, uri):  # Constructor that initializes the main attributes of the phenotype
         self.code = code
         self.label = label
         self.uri = uri
         self.genes = set()
+        self._gene_count = None  # Set by DataManager once loading is finished
 
     def add_gene(self, gene):
         """Adds a gene to the set of genes associated with this phenotype"""
-        self.genes.add(gene)
+        self.genes.add(sys.intern(gene))  # Interned, so it is the same object as the gene symbol of the variants
 
     def gene_count(self):
         """Returns the total number of genes associated with this phenotype"""
-        return len(self.genes)
+        if self._gene_count is None:  # Still loading
+            return len(self.genes)
+        return self._gene_count
 
 class Patient:
     """Represents a patient identified by their record, including associated phenotypes and variants"""
     
+    __slots__ = ('record', 'phenotypes', 'variants', 'gene_bitmap')
+
     def __init__(self, record):
         self.record = record
         self.phenotypes = []  # List of phenotypes associated with the patient
-        self.variants = []  # List of genetic variants associated with the patient
+        self.variants = array('i')  # Rows of the patient's genetic variants in the variant table
+        # One byte per gene code, 1 for the genes of the patient's phenotypes (set once loading ends)
+        self.gene_bitmap = bytearray()
 
     def add_phenotype(self, phenotype):
         """Adds a phenotype to the patient's phenotype list"""
         self.phenotypes.append(phenotype)
 
-    def add_variant(self, variant):
-        """Adds a variant to the patient's variant list"""
-        self.variants.append(variant)
-
     def variant_count(self):
         """Returns the number of variants associated with the patient"""
         return len(self.variants)
 
+class Vocabulary:
+    """Assigns small integer codes to repeated strings such as chromosomes, genes or patient records"""
+
+    def __init__(self):
+        self.labels = []  # List of strings, indexed by their code
+        self.codes = {}  # Dictionary from string to code
+
+    def __len__(self):
+        return len(self.labels)
+
+    def encode(self, label):
+        """Returns the code of a string, registering it if it has not been seen before"""
+        code = self.codes.get(label)
+        if code is None:
+            label = sys.intern(label)  # Equal strings elsewhere in the program (e.g. phenotype genes) share this object
+            code = self.codes[label] = len(self.labels)
+            self.labels.append(label)
+        return code
+
+    def lookup(self, label):
+        """Returns the code of a known string, or -1 if it has never been seen"""
+        return self.codes.get(label, -1)
+
 class Variant:
-    """Represents a genetic variant with its specific characteristics"""
-    
-    def __init__(self, patient_id, chr, pos_start, pos_end, reference, genotype, gene_symbol):
-        self.patient_id = patient_id
-        self.chr = chr
-        self.pos_start = pos_start
-        self.pos_end = pos_end
-        self.reference = reference
-        self.genotype = genotype
-        self.gene_symbol = gene_symbol
+    """Represents a genetic variant with its specific characteristics.
+       It is a lightweight view over one row of a VariantTable"""
+
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __str__(self):
+        return next(self.table.format_rows((self.row,)))
+
+    @property
+    def patient_id(self):
+        return self.table.patients.labels[self.table.patient_codes[self.row]]
+
+    @property
+    def chr(self):
+        return self.table.chromosomes.labels[self.table.chr_codes[self.row]]
+
+    @property
+    def pos_start(self):
+        return self.table.pos_start[self.row]
+
+    @property
+    def pos_end(self):
+        return self.table.pos_end[self.row]
+
+    @property
+    def reference(self):
+        return self.table.references.labels[self.table.reference_codes[self.row]]
+
+    @property
+    def genotype(self):
+        return self.table.genotypes.labels[self.table.genotype_codes[self.row]]
+
+    @property
+    def gene_symbol(self):
+        return self.table.genes.labels[self.table.gene_codes[self.row]]
+
+class VariantTable:
+    """Stores all variants column by column (one typed array per field) instead of one object per variant.
+       Repeated strings are stored as integer codes, which keeps memory low and makes scans cheap"""
+
+    QUERY_CACHE_SIZE = 128  # Number of recent searches remembered by query()
+    QUERY_CACHE_ROWS = 1 << 16  # Larger results are not remembered, they would take too much memory
+
+    def __init__(self):
+        self.patients = Vocabulary()  # Codes for patient IDs
+        self.chromosomes = Vocabulary()  # Codes for chromosomes
+        self.genes = Vocabulary()  # Codes for gene symbols
+        self.references = Vocabulary()  # Codes for reference alleles
+        self.genotypes = Vocabulary()  # Codes for genotypes
+        self.patient_codes = array('i')
+        self.chr_codes = array('i')
+        self.pos_start = array('i')
+        self.pos_end = array('i')
+        self.reference_codes = array('i')
+        self.genotype_codes = array('i')
+        self.gene_codes = array('i')
+        self.rows_by_patient = {}  # Patient code -> rows of that patient, filled by build_indexes()
+        self.rows_by_gene = {}  # Gene code -> rows in that gene, filled by build_indexes()
+        self.gene_counts = Counter()  # Gene code -> number of variants, filled by build_indexes()
+        # Chromosome code -> (sorted start positions, their rows, largest start - end), filled by build_indexes()
+        self.positions_by_chr = {}
+        self._queries = {}  # Recent searches of query() -> their rows, least recently used first
+
+    def __len__(self):
+        return len(self.pos_start)
+
+    def __getitem__(self, row):
+        return Variant(self, row)
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
+
+    def add_variants(self, patient_id, chrs, starts, ends, references, genotypes, gene_symbols):
+        """Appends the variants of one patient, given column by column (positions as int arrays).
+           Returns the range of rows they were stored in"""
+        first_row = len(self)
+        self.patient_codes.extend(repeat(self.patients.encode(patient_id), len(starts)))
+        self.chr_codes.extend(map(self.chromosomes.encode, chrs))
+        self.pos_start.extend(starts)
+        self.pos_end.extend(ends)
+        self.reference_codes.extend(map(self.references.encode, references))
+        self.genotype_codes.extend(map(self.genotypes.encode, genotypes))
+        self.gene_codes.extend(map(self.genes.encode, gene_symbols))
+        return range(first_row, len(self))
+
+    def compact_codes(self):
+        """Stores each code column with the narrowest integer type its vocabulary fits in
+           (1 byte for chromosomes and genotypes, usually 2 bytes for genes), so scans read fewer bytes"""
+        for name, vocabulary in (("patient_codes", self.patients), ("chr_codes", self.chromosomes),
+                                 ("reference_codes", self.references), ("genotype_codes", self.genotypes),
+                                 ("gene_codes", self.genes)):
+            typecode = 'b' if len(vocabulary) <= 2 ** 7 else 'h' if len(vocabulary) <= 2 ** 15 else 'i'
+            column = getattr(self, name)
+            if column.typecode != typecode:
+                setattr(self, name, array(typecode, column))
+
+    def build_indexes(self):
+        """Groups the rows by patient and by gene, so that searches on them do not scan the whole table.
+           Also counts the variants of each gene, which does not change after loading either"""
+        self.rows_by_patient = self._group_rows(self.patient_codes)
+        self.rows_by_gene = self._group_rows(self.gene_codes)
+        self.gene_counts = Counter({gene_code: len(rows) for gene_code, rows in self.rows_by_gene.items()})
+        self.positions_by_chr = {}
+        for chr_code, rows in self._group_rows(self.chr_codes).items():  # Sort each chromosome by start position
+            rows = sorted(rows, key=self.pos_start.__getitem__)
+            # Some variants start after they end (e.g. insertions written as end = start - 1)
+            overshoot = max(0, max(map(sub, map(self.pos_start.__getitem__, rows),
+                                       map(self.pos_end.__getitem__, rows))))
+            self.positions_by_chr[chr_code] = (array('i', map(self.pos_start.__getitem__, rows)), array('i', rows),
+                                               overshoot)
+
+    @staticmethod
+    def _group_rows(codes):
+        """Returns a dictionary from each code to the (ascending) rows where it appears"""
+        groups = {}
+        for row, code in enumerate(codes):
+            rows = groups.get(code)
+            if rows is None:
+                rows = groups[code] = array('i')
+            rows.append(row)
+        return groups
+
+    def query(self, patient_id=None, chromosome=None, pos_start=None, pos_end=None, gene=None):
+        """Same as select, but remembers the rows of recent searches (as int arrays) so that repeating one
+           is immediate"""
+        key = (patient_id, chromosome, pos_start, pos_end, gene)
+        rows = self._queries.pop(key, None)
+        if rows is None:
+            rows = array('i', self.select(*key))
+            if len(rows) > self.QUERY_CACHE_ROWS:
+                return rows
+        self._queries[key] = rows  # Moved to the end, as the most recently used
+        if len(self._queries) > self.QUERY_CACHE_SIZE:
+            del self._queries[next(iter(self._queries))]  # Forget the least recently used search
+        return rows
+
+    def select(self, patient_id=None, chromosome=None, pos_start=None, pos_end=None, gene=None):
+        """Returns the rows matching every given criterion (None means the criterion is not used)"""
+        codes = []  # Strings are translated to their codes once, before scanning the columns
+        for value, vocabulary in ((patient_id, self.patients), (chromosome, self.chromosomes), (gene, self.genes)):
+            code = vocabulary.lookup(value) if value is not None else None
+            if code == -1:  # An unknown value cannot match any row
+                return []
+            codes.append(code)
+        patient_code, chr_code, gene_code = codes
+        columns = (self.patient_codes, self.chr_codes, self.pos_start, self.pos_end, self.gene_codes)
+        criteria = dict(patient_q=patient_code, chr_q=chr_code, lo=pos_start, hi=pos_end, gene_q=gene_code)
+
+        buckets = []  # Candidate rows given by the indexes, with the criteria those rows already satisfy
+        if patient_code is not None:
+            buckets.append((self.rows_by_patient.get(patient_code, ()), ('patient_q',)))
+        if gene_code is not None:
+            buckets.append((self.rows_by_gene.get(gene_code, ()), ('gene_q',)))
+        if chr_code is not None or pos_start is not None or pos_end is not None:
+            buckets.append((self._rows_in_range(chr_code, pos_start, pos_end), ('chr_q', 'lo')))
+
+        if not buckets:
+            return filters.filter_variants(*columns, **criteria)
+        rows, satisfied = min(buckets, key=lambda bucket: len(bucket[0]))
+        if len(rows) > len(self) // 4:  # Not selective enough, scanning the columns is faster
+            return filters.filter_variants(*columns, **criteria)
+        for name in satisfied:  # Only check what the index does not already guarantee
+            criteria[name] = None
+        # Check the remaining criteria on the candidate rows only, and give the rows back in table order
+        return sorted(filters.filter_rows(rows, *columns, **criteria))
+
+    def format_rows(self, rows):
+        """Returns the display line 'chr:pos_start:pos_end:reference:genotype (gene)' of each given row.
+           The lines are built column by column, without creating a Variant for each row"""
+        def decoded(vocabulary, codes):  # Strings of a coded column at the given rows
+            return map(vocabulary.labels.__getitem__, map(codes.__getitem__, rows))
+        columns = zip(decoded(self.chromosomes, self.chr_codes),
+                      map(self.pos_start.__getitem__, rows), map(self.pos_end.__getitem__, rows),
+                      decoded(self.references, self.reference_codes), decoded(self.genotypes, self.genotype_codes),
+                      decoded(self.genes, self.gene_codes))
+        return (f"{chr}:{pos_start}:{pos_end}:{reference}:{genotype} ({gene})"
+                for chr, pos_start, pos_end, reference, genotype, gene in columns)
+
+    def gene_bitmap(self, genes):
+        """Returns one byte per gene code, set to 1 for the codes of the given gene symbols"""
+        bitmap = bytearray(len(self.genes))
+        for code in map(self.genes.lookup, genes):
+            if code != -1:  # Genes without variants have no code
+                bitmap[code] = 1
+        return bitmap
+
+    def rows_in_genes(self, rows, bitmap):
+        """Keeps the given rows whose gene is set in a bitmap made by gene_bitmap"""
+        return list(compress(rows, map(bitmap.__getitem__, map(self.gene_codes.__getitem__, rows))))
+
+    def _rows_in_range(self, chr_code, pos_start, pos_end):
+        """Returns the rows (on one chromosome, or on all if chr_code is None) whose start position
+           lies between pos_start and pos_end (plus the chromosome's largest start - end overshoot),
+           found by binary search on the sorted start positions. This includes every row that can match the range"""
+        chr_codes = [chr_code] if chr_code is not None else self.positions_by_chr
+        rows = array('i')
+        for code in chr_codes:
+            starts, sorted_rows, overshoot = self.positions_by_chr[code]
+            first = bisect_left(starts, pos_start) if pos_start is not None else 0
+            last = bisect_right(starts, pos_end + overshoot) if pos_end is not None else len(starts)
+            rows.extend(sorted_rows[first:last])
+        return rows
+
+class _ArrayPickler(pickle.Pickler):
+    """Pickler that leaves the int arrays (row columns and indexes) out of the pickle, so that they can be
+       saved as raw bytes and memory-mapped when loading. An array shared by several objects is left out once"""
+
+    def __init__(self, file):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.arrays = {}  # id() of each array left out -> (its number, the array)
+
+    def persistent_id(self, obj):
+        if type(obj) is not array:
+            return None  # Pickled as usual
+        return self.arrays.setdefault(id(obj), (len(self.arrays), obj))[0]
+
+class _ArrayUnpickler(pickle.Unpickler):
+    """Unpickler for the output of _ArrayPickler, given the arrays it left out in the order of their numbers"""
+
+    def __init__(self, file, arrays):
+        super().__init__(file)
+        self.arrays = arrays
+
+    def persistent_load(self, number):
+        return self.arrays[number]
 
 class DataManager:
     """Class to manage loading and manipulation of phenotype, patient, and variant data"""
     
-    def __init__(self, phenotypes_path, patients_path, variants_dir):
+    def __init__(self, phenotypes_path, patients_path, variants_dir, cache_path=None):
         self.phenotypes = {}
         self.patients = {}
-        self.variants = []
-        self.load_phenotypes(phenotypes_path)
-        self.load_patients(patients_path)
-        self.load_variants(variants_dir)
+        self.variants = VariantTable()
+        self.load_errors = 0  # Number of files that could not be loaded
+        self.skipped_rows = 0  # Incomplete or invalid rows left out, the same on every load of unchanged files
+        # If a cache file is given, the CSV files are only parsed when they changed since it was written
+        signature = self.source_signature(phenotypes_path, patients_path, variants_dir) if cache_path else None
+        if signature is None or not self.load_cache(cache_path, signature):
+            self.load_phenotypes(phenotypes_path)
+            self.load_patients(patients_path)
+            self.load_variants(variants_dir)
+            self._finalize()
+            # Never cache a load that missed files, skipped rows are skipped again anyway
+            if signature is not None and not self.load_errors:
+                self.save_cache(cache_path, signature)
+        variants = self.variants  # Compile the search filter now, for these columns, rather than on the first search
+        filters.warm_up(variants.patient_codes, variants.chr_codes, variants.pos_start, variants.pos_end,
+                        variants.gene_codes)
+
+    def _finalize(self):
+        """Precomputes what only depends on the loaded data, which does not change after loading"""
+        
+        for phenotype in self.phenotypes.values():
+            phenotype.genes = frozenset(phenotype.genes)  # No genes are added after loading
+            phenotype._gene_count = len(phenotype.genes)
+        self.variants.compact_codes()  # No new codes can appear once everything is loaded
+        self.variants.build_indexes()  # Index the variants by patient and gene once they are all loaded
+        bitmaps = {}  # Patients with the same relevant genes share one bitmap
+        for record, patient in self.patients.items():  # Each patient shares its row list with the index
+            patient_code = self.variants.patients.lookup(record)
+            patient.variants = self.variants.rows_by_patient.get(patient_code, patient.variants)
+            # Computed now, so that recommendations never have to
+            genes = frozenset().union(*(phenotype.genes for phenotype in patient.phenotypes))
+            if genes not in bitmaps:
+                bitmaps[genes] = self.variants.gene_bitmap(genes)
+            patient.gene_bitmap = bitmaps[genes]
+
+    @staticmethod
+    def source_signature(phenotypes_path, patients_path, variants_dir):
+        """Returns the cache version and the name, modification time and size of every input file,
+           or None if one is missing. Any change to the inputs (edited, added or removed files) changes it"""
+        
+        file_paths = [Path(phenotypes_path), Path(patients_path)] + sorted(Path(variants_dir).glob("PAC*.csv"))
+        try:
+            return (CACHE_VERSION,) + tuple((str(path), path.stat().st_mtime_ns, path.stat().st_size)
+                                            for path in file_paths)
+        except OSError:
+            return None
+
+    def load_cache(self, cache_path, signature):
+        """Loads the data saved by save_cache if it was saved from the same input files.
+           Returns False (and loads nothing) if the cache is missing, outdated or unreadable"""
+        
+        try:
+            with open(cache_path, mode='rb') as cache_file:
+                if pickle.load(cache_file) != signature:  # Header only, the data is not read if it is outdated
+                    return False
+                layout = pickle.load(cache_file)
+                # The arrays follow as raw bytes and are mapped instead of read, then come the other objects
+                mapping = memoryview(mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ))
+                arrays, offset = _map_arrays(mapping, layout, cache_file.tell())
+                cache_file.seek(offset)
+                phenotypes, patients, variants = _ArrayUnpickler(cache_file, arrays).load()
+                if cache_file.read(1):
+                    raise ValueError("unexpected data after the cached objects")
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"Ignoring unreadable cache {cache_path}: {e}")
+            return False
+        self.phenotypes, self.patients, self.variants = phenotypes, patients, variants
+        return True
+
+    def save_cache(self, cache_path, signature):
+        """Saves the loaded data so that the next run can skip parsing the CSV files.
+           The cache is only meant to be read back by this program"""
+        
+        temporary_path = f"{cache_path}.tmp"
+        try:
+            objects = io.BytesIO()  # Small, the arrays are left out of it
+            pickler = _ArrayPickler(objects)
+            pickler.dump((self.phenotypes, self.patients, self.variants))
+            arrays = [values for number, values in pickler.arrays.values()]  # In the order of their numbers
+            with open(temporary_path, mode='wb') as cache_file:
+                pickle.dump(signature, cache_file, protocol=pickle.HIGHEST_PROTOCOL)  # Header
+                pickle.dump([(values.typecode, len(values)) for values in arrays], cache_file,
+                            protocol=pickle.HIGHEST_PROTOCOL)  # Layout of the raw arrays
+                for values in arrays:
+                    cache_file.write(bytes(-cache_file.tell() % 8))  # Each array starts at a multiple of 8 bytes
+                    values.tofile(cache_file)
+                cache_file.write(objects.getbuffer())
+            os.replace(temporary_path, cache_path)  # Readers never see a half-written cache
+        except Exception as e:
+            try:  # Do not leave a half-written file behind
+                os.remove(temporary_path)
+            except OSError:
+                pass
+            print(f"Could not write cache {cache_path}: {e}")
 
     def load_phenotypes(self, file_path):
         """Loads phenotypes from a CSV file"""
         
-        try:  # Try to load the data, catch any errors
-            with open(file_path, mode='r') as csv_file:  # Open the file in read mode
-                csv_reader = csv.DictReader(csv_file, delimiter=';')  # Read the file as a dictionary
-                for row in csv_reader:  # Iterate over each row in the file
-                    code = row["codigo"]  # Extract the phenotype code
-                    if code not in self.phenotypes:  # If the phenotype is not already in the dictionary
-                        phenotype = Phenotype(code, row["label"], row["uri"])  # Create a new Phenotype instance
-                        self.phenotypes[code] = phenotype  # Add the phenotype to the dictionary
-                    self.phenotypes[code].add_gene(row["gene"])  # Add the associated gene to the phenotype
-        except FileNotFoundError:  # Error handling if file is not found
-            print(f"File {file_path} not found. Please verify the path.")
-        except Exception as e:  # Handle other loading errors
-            print(f"Error loading phenotypes: {e}")
+        for code, label, uri, gene in self._read_csv(file_path, ("codigo", "label", "uri", "gene"), "phenotypes"):
+            phenotype = self.phenotypes.get(code)
+            if phenotype is None:  # If the phenotype is not already in the dictionary
+                phenotype = Phenotype(code, label, uri)  # Create a new Phenotype instance
+                self.phenotypes[code] = phenotype  # Add the phenotype to the dictionary
+            phenotype.add_gene(gene)  # Add the associated gene to the phenotype
 
     def load_patients(self, file_path):
         """Loads patients from a CSV file"""
         
-        try:
-            with open(file_path, mode='r') as csv_file:
-                csv_reader = csv.DictReader(csv_file, delimiter=';')
-                for row in csv_reader:
-                    record = row["expediente"]
-                    if record not in self.patients:
-                        self.patients[record] = Patient(record)
-                    phenotype = self.phenotypes.get(row["fenotipo"])
-                    if phenotype:
-                        self.patients[record].add_phenotype(phenotype)
-        except FileNotFoundError:
+        for record, phenotype_code in self._read_csv(file_path, ("expediente", "fenotipo"), "patients"):
+            patient = self.patients.get(record)
+            if patient is None:
+                patient = self.patients[record] = Patient(record)
+            phenotype = self.phenotypes.get(phenotype_code)
+            if phenotype:
+                patient.add_phenotype(phenotype)
+
+    def _read_csv(self, file_path, columns, content):
+        """Returns the given columns of every row of a CSV file, or no rows if the file cannot be read.
+           Problems are reported to the user and counted in load_errors (skipped rows in skipped_rows)"""
+        
+        try:  # Only reading the file is guarded, the rows are processed by the caller
+            rows, skipped = _read_columns(file_path, columns)
+        except FileNotFoundError:  # Error handling if file is not found
             print(f"File {file_path} not found. Please verify the path.")
-        except Exception as e:
-            print(f"Error loading patients: {e}")
+            self.load_errors += 1
+            return []
+        except Exception as e:  # Handle other loading errors
+            print(f"Error loading {content}: {e}")
+            self.load_errors += 1
+            return []
+        self._report_skipped(Path(file_path).name, skipped)
+        return rows
+
+    def _report_skipped(self, file_name, skipped):
+        """Warns about the rows of a file that were skipped for missing fields or invalid positions"""
+        if skipped:
+            print(f"Skipped {skipped} incomplete or invalid line(s) in {file_name}.")
+            self.skipped_rows += skipped
 
     def load_variants(self, directory_path):
-        """Loads variants from CSV files in a directory"""
+        """Loads variants from CSV files in a directory, parsing the files in parallel"""
         
         directory = Path(directory_path)  # Define the directory
-        for file_path in directory.glob("PAC*.csv"):  # Find files starting with PAC and ending with .csv
+        file_paths = list(directory.glob("PAC*.csv"))  # Find files starting with PAC and ending with .csv
+        workers = max(1, min(os.cpu_count() or 1, len(file_paths)))  # No more processes than files to parse
+        with ProcessPoolExecutor(workers) as executor:  # Each file is independent, so they are parsed in separate processes
+            futures = [executor.submit(_parse_variant_file, file_path) for file_path in file_paths]
+            for file_path, future in zip(file_paths, futures):  # Collect in file order so that row order is kept
+                patient_id = file_path.stem  # Get the filename without extension as patient ID
+                try:  # Only reading the file is guarded
+                    columns, skipped = future.result()
+                except FileNotFoundError:
+                    print(f"File {file_path.name} not found. Please verify the folder and file names.")
+                    self.load_errors += 1
+                    continue
+                except Exception as e:
+                    print(f"Error loading variants for patient {patient_id}: {e}")
+                    self.load_errors += 1
+                    continue
+                self._report_skipped(file_path.name, skipped)
+                self.variants.add_variants(patient_id, *columns)
+
+def _map_arrays(mapping, layout, offset):
+    """Returns views (without copying) of the raw arrays saved by save_cache from the given offset of a
+       memory-mapped cache, given the typecode and length of each, and the offset where they end.
+       The operating system only reads a part of the file when it is used"""
+    
+    views = []
+    for typecode, length in layout:
+        offset += -offset % 8
+        size = length * array(typecode).itemsize
+        if offset + size > len(mapping):  # Slicing would silently give a shorter array
+            raise ValueError("cached arrays are truncated")
+        views.append(mapping[offset:offset + size].cast(typecode))
+        offset += size
+    return views, offset
+
+def _read_columns(file_path, columns):
+    """Reads a ';'-separated CSV file and returns the given columns of each row as tuples,
+       together with the number of rows skipped because they miss some of those columns"""
+    
+    with open(file_path, mode='r', newline='') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=';')  # Read the file as plain lists, no per-row dict
+        header = next(csv_reader, None)
+        if header is None:  # Empty file
+            return [], 0
+        fields = itemgetter(*map(header.index, columns))  # Only the needed columns, resolved once from the header
+        parsed = map(fields, filter(None, csv_reader))  # Blank lines are ignored
+        rows, skipped = [], 0
+        while True:
             try:
-                with file_path.open(mode='r') as csv_file:
-                    csv_reader = csv.DictReader(csv_file, delimiter=';')
-                    patient_id = file_path.stem  # Get the filename without extension as patient ID
-                    for row in csv_reader:
-                        variant = Variant(
-                            patient_id, row["chr"], int(row["pos_start"]),
-                            int(row["pos_end"]), row["reference"], row["genotype"],
-                            row["gene_symbol"])
-                        self.variants.append(variant)
-                        if patient_id in self.patients:
-                            self.patients[patient_id].add_variant(variant)
-            except FileNotFoundError:
-                print(f"File {file_path.name} not found. Please verify the folder and file names.")
-            except Exception as e:
-                print(f"Error loading variants for patient {file_path.stem}: {e}")
+                rows.extend(parsed)  # Runs at C speed until a row that is too short, which is then skipped
+                return rows, skipped
+            except IndexError:
+                skipped += 1
+
+def _read_arrow_table(file_path):
+    """Reads a variant CSV with pyarrow and returns the table and the number of rows skipped because they
+       miss some of the variant columns, or None if the file has rows pyarrow cannot keep as the csv path would
+       (e.g. more fields than the header)"""
+    
+    with open(file_path, mode='r', newline='') as csv_file:
+        header = next(csv.reader(csv_file, delimiter=';'), [])
+    needed = 1 + max(map(header.index, VARIANT_COLUMNS))  # Fields a row needs to have every variant column
+    skipped = 0
+
+    def invalid_row(row):  # Only rows that are too short are skipped, like in the csv path
+        nonlocal skipped
+        if row.actual_columns < needed:
+            skipped += 1
+            return 'skip'
+        return 'error'
+    
+    try:
+        table = arrow_csv.read_csv(
+            file_path, parse_options=arrow_csv.ParseOptions(delimiter=';', invalid_row_handler=invalid_row),
+            convert_options=arrow_csv.ConvertOptions(
+                include_columns=list(VARIANT_COLUMNS), null_values=[],  # An unreadable position is an error
+                column_types={name: pa.int32() if name in ("pos_start", "pos_end") else pa.string()
+                              for name in VARIANT_COLUMNS}))
+    except pa.ArrowInvalid:  # Left to the csv path, which keeps such rows or skips them
+        return None
+    return table, skipped
+
+def _parse_variant_file(file_path):
+    """Reads one patient's variant CSV and returns its columns
+       (chr, pos_start, pos_end, reference, genotype, gene_symbol), with the positions as int arrays,
+       and the number of incomplete rows or rows with invalid positions that were skipped.
+       It runs in a worker process, so it only takes and returns picklable values"""
+    
+    # Multithreaded native parser, positions are converted to int32 while parsing (it rejects empty files)
+    table = _read_arrow_table(file_path) if arrow_csv is not None and file_path.stat().st_size else None
+    if table is not None:
+        table, skipped = table
+        chrs, references, genotypes, gene_symbols = (
+            table.column(name).to_pylist() for name in ("chr", "reference", "genotype", "gene_symbol"))
+        starts, ends = (_int_array(table.column(name)) for name in ("pos_start", "pos_end"))
+        return (chrs, starts, ends, references, genotypes, gene_symbols), skipped
+    rows, skipped = _read_columns(file_path, VARIANT_COLUMNS)
+    try:
+        columns = _variant_columns(rows)
+    except (ValueError, OverflowError):  # Some position is not a whole number that fits in int32
+        valid_rows = [row for row in rows if _is_position(row[1]) and _is_position(row[2])]
+        skipped += len(rows) - len(valid_rows)
+        columns = _variant_columns(valid_rows)
+    return columns, skipped
+
+def _int_array(column):
+    """Copies an int32 pyarrow column (which has no nulls) into an int array straight from its data buffer,
+       without creating a Python int per value"""
+    column = column.combine_chunks()
+    values = array('i')
+    if len(column):
+        values.frombytes(column.buffers()[1][column.offset * values.itemsize:
+                                             (column.offset + len(column)) * values.itemsize])
+    return values
+
+def _variant_columns(rows):
+    """Turns variant rows into columns, with the positions as int arrays"""
+    chrs, starts, ends, references, genotypes, gene_symbols = list(zip(*rows)) or [()] * len(VARIANT_COLUMNS)
+    # int() still runs on every position, but map and array drive it from C instead of a Python loop
+    return chrs, array('i', map(int, starts)), array('i', map(int, ends)), references, genotypes, gene_symbols
+
+def _is_position(value):
+    """Tells whether a field holds a whole number that fits in the int32 position columns"""
+    try:
+        return -2 ** 31 <= int(value) < 2 ** 31
+    except ValueError:
+        return False
+
+def write_lines(lines):
+    """Writes lines to the console in blocks of about 64 KB instead of calling print() once per line"""
+    
+    block, size = [], 0
+    for line in lines:
+        block.append(line)
+        size += len(line) + 1
+        if size >= 65536:  # Write out a full block and start the next one
+            sys.stdout.write("\n".join(block) + "\n")
+            block, size = [], 0
+    if block:
+        sys.stdout.write("\n".join(block) + "\n")
 
 def show_menu(data_manager):
     """Displays the main menu and manages user interaction"""
@@ -145,11 +642,13 @@ def show_menu(data_manager):
 def list_patients(data_manager):
     """Lists patients indicating the number of genetic variants they have and their phenotypes"""
     
+    lines = []
     for patient in data_manager.patients.values():  # Iterate over each patient in the dictionary
-        print(f"{patient.record} (Variants: {patient.variant_count()})")  # Print record and variant count
+        lines.append(f"{patient.record} (Variants: {patient.variant_count()})")  # Record and variant count
         for phenotype in patient.phenotypes:  # For each phenotype associated with the patient
-            print(f"  - {phenotype.label} ({phenotype.code}) [Gene Count: {phenotype.gene_count()}]")  # Print phenotype info
-        print()  # Print a blank line to separate each patient
+            lines.append(f"  - {phenotype.label} ({phenotype.code}) [Gene Count: {phenotype.gene_count()}]")  # Phenotype info
+        lines.append("")  # A blank line to separate each patient
+    write_lines(lines)
     patient_submenu(data_manager)  # Call the submenu for patient-specific options
 
 def patient_submenu(data_manager):
@@ -174,20 +673,16 @@ def patient_submenu(data_manager):
 def list_genes(data_manager):
     """Lists all genes associated with variants"""
     
-    gene_count = {}  # Dictionary to count the number of occurrences of each gene
-    for variant in data_manager.variants:  # Iterate over each variant in the variant list
-        if variant.gene_symbol in gene_count:  # If the gene is already in the dictionary, increment counter
-            gene_count[variant.gene_symbol] += 1
-        else:  # If the gene is not in the dictionary, add it with initial count of 1
-            gene_count[variant.gene_symbol] = 1
-    for gene, count in gene_count.items():  # Iterate over each gene and its count in the dictionary
-        print(f"{gene} ({count})")  # Print the gene name and number of occurrences
+    variants = data_manager.variants
+    genes = variants.genes.labels
+    # Gene name and number of occurrences, counted once when the data was loaded
+    write_lines(f"{genes[gene_code]} ({count})" for gene_code, count in variants.gene_counts.items())
 
 def list_phenotypes(data_manager):
     """Function to list all phenotypes with their gene count"""
     
-    for phenotype in data_manager.phenotypes.values():  # Iterate over each phenotype in the dictionary
-        print(f"{phenotype.label} ({phenotype.code}) [Gene Count: {phenotype.gene_count()}]")  # Print label, code, and gene count
+    write_lines(f"{phenotype.label} ({phenotype.code}) [Gene Count: {phenotype.gene_count()}]"  # Label, code, and gene count
+                for phenotype in data_manager.phenotypes.values())
 
 def search_variants(data_manager):
     """Searches for variants based on patient code, chromosome, start and end position, and gene"""
@@ -198,15 +693,17 @@ def search_variants(data_manager):
     pos_end = input("End position: ")
     gene = input("Gene: ")
 
-    for variant in data_manager.variants:  # Iterate over each variant in the variant list
-        # Check each criterion entered by the user, if it doesn't match continue to the next
-        if (patient_code and variant.patient_id != patient_code) or \
-           (chromosome and variant.chr != chromosome) or \
-           (pos_start and variant.pos_start < int(pos_start)) or \
-           (pos_end and variant.pos_end > int(pos_end)) or \
-           (gene and variant.gene_symbol != gene):
-            continue
-        print(f"{variant.chr}:{variant.pos_start}:{variant.pos_end}:{variant.reference}:{variant.genotype} ({variant.gene_symbol})")
+    try:  # Positions are converted once, before searching
+        pos_start = int(pos_start) if pos_start else None
+        pos_end = int(pos_end) if pos_end else None
+    except ValueError:
+        print("ERROR. Start and end positions must be whole numbers.")
+        return
+
+    variants = data_manager.variants
+    # Empty answers mean the criterion is not used
+    rows = variants.query(patient_code or None, chromosome or None, pos_start, pos_end, gene or None)
+    write_lines(variants.format_rows(rows))  # Display the matching rows only
 
 def recommend_variants(data_manager):
     """Recommends variants based on a patient's phenotypes"""
@@ -218,14 +715,9 @@ def recommend_variants(data_manager):
         print("Patient not found")
         return
 
-    relevant_genes = set()  # Create a set to store relevant genes based on the patient's phenotypes
-
-    for phenotype in patient.phenotypes:  # Iterate over each phenotype of the patient
-        relevant_genes.update(phenotype.genes)  # Add genes from each phenotype to the relevant genes set
-
-    for variant in patient.variants:  # Iterate over each variant of the patient
-        if variant.gene_symbol in relevant_genes:  # If the variant's gene is in the relevant genes, display it
-            print(f"{variant.chr}:{variant.pos_start}:{variant.pos_end}:{variant.reference}:{variant.genotype} ({variant.gene_symbol})")
+    variants = data_manager.variants
+    # Display the patient's variants whose gene is set in the bitmap of genes from each phenotype of the patient
+    write_lines(variants.format_rows(variants.rows_in_genes(patient.variants, patient.gene_bitmap)))
 
 def main():
     """Loads data and calls the main menu"""
@@ -234,9 +726,10 @@ def main():
     phenotypes_path = "path/to/your/phenotypes_metadata.csv"
     patients_path = "path/to/your/patients_metadata.csv"
     variants_dir = "path/to/your/VCFS"
+    cache_path = "path/to/your/variant_explorer.cache"  # Parsed data is kept here to speed up the next runs
     
     # Create a DataManager instance with the specified files and directory
-    data_manager = DataManager(phenotypes_path, patients_path, variants_dir)
+    data_manager = DataManager(phenotypes_path, patients_path, variants_dir, cache_path)
     show_menu(data_manager)
     
 # Call main() if the script is executed directly